@@ -6,6 +6,7 @@ from cached_property import cached_property
 
 from tracelog import TRACELOG
 from .bead import UnpackableBead
+from .tech.timestamp import time_from_timestamp
 from . import meta
 from . import tech
 
@@ -20,6 +21,9 @@ __all__ = ('Archive', 'InvalidArchive')
 CACHE_CONTENT_ID = 'content_id'
 CACHE_INPUT_MAP = 'input_map'
 
+# metadata, that must be available for an Archive (from the cache or the zip)
+_REQUIRED_CACHE_KEYS = (meta.META_VERSION, meta.KIND, meta.FREEZE_TIME)
+
 
 def _cached_zip_attribute(cache_key: str, ziparchive_attribute):
     """Make a cache accessor @property with a self.ziparchive.attribute fallback
@@ -36,21 +40,26 @@ def _cached_zip_attribute(cache_key: str, ziparchive_attribute):
 
 
 class Archive(UnpackableBead):
-    def __init__(self, filename, box_name=''):
+    def __init__(self, filename, box_name='', cache=None, has_cache_file=True):
         self.archive_filename = filename
         self.archive_path = pathlib.Path(filename)
         self.box_name = box_name
         self.name = bead_name_from_file_path(filename)
         self.cache = {}
-        self.load_cache()
+        # the .xmeta file is not looked for, when it is known to be missing (e.g. by a box index)
+        if has_cache_file:
+            self.load_cache()
+        # known metadata, e.g. from a box index
+        # - it is checked against the zip archive, when that is opened
+        for cache_key, value in (cache or {}).items():
+            self.cache.setdefault(cache_key, value)
 
         # Check that we can get access to metadata
         #  - either through the cache or through the archive
         # The resulting archive can still be invalid and die unexpectedly later with
         # InvalidArchive exception, as these are potentially cached values
-        self.meta_version
-        self.freeze_time
-        self.kind
+        if not all(key in self.cache for key in _REQUIRED_CACHE_KEYS):
+            self.ziparchive
 
     def load_cache(self):
         try:
@@ -79,6 +88,11 @@ class Archive(UnpackableBead):
     kind = _cached_zip_attribute(meta.KIND, 'kind')
     freeze_time_str = _cached_zip_attribute(meta.FREEZE_TIME, 'freeze_time_str')
 
+    @cached_property
+    def freeze_time(self):
+        # parsed once: archives are compared by freeze time many times when searching
+        return time_from_timestamp(self.freeze_time_str)
+
     @property
     def input_map(self):
         try:
@@ -144,6 +158,9 @@ class Archive(UnpackableBead):
         workspace.input_map = self.input_map
 
 
+_TIMESTAMP_SUFFIX = re.compile('_[0-9]{8}(?:[tT][-+0-9]*)?$')
+
+
 def bead_name_from_file_path(path):
     '''
     Parse bead name from a file path.
@@ -152,12 +169,15 @@ def bead_name_from_file_path(path):
     '''
     name_with_timestamp, ext = os.path.splitext(os.path.basename(path))
     # assert ext == '.zip'  # not enforced to allow having beads with different extensions
-    name = re.sub('_[0-9]{8}(?:[tT][-+0-9]*)?$', '', name_with_timestamp)
+    name = _TIMESTAMP_SUFFIX.sub('', name_with_timestamp)
     return name
 
 
-assert 'bead-2015v3' == bead_name_from_file_path('bead-2015v3.zip')
-assert 'bead-2015v3' == bead_name_from_file_path('bead-2015v3_20150923.zip')
-assert 'bead-2015v3' == bead_name_from_file_path('bead-2015v3_20150923T010203012345+0200.zip')
-assert 'bead-2015v3' == bead_name_from_file_path('bead-2015v3_20150923T010203012345-0200.zip')
-assert 'bead-2015v3' == bead_name_from_file_path('path/to/bead-2015v3_20150923.zip')
+def is_archive_file_name(file_name):
+    '''
+    Can a file in a box directory be an archive?
+
+    Hidden files (e.g. the box index) and .xmeta cache files are not archives,
+    but other extensions than .zip are allowed (see bead_name_from_file_path).
+    '''
+    return not file_name.startswith('.') and not file_name.endswith('.xmeta')
@@ -15,62 +15,119 @@ Boxes can be used to:
 '''
 
 from datetime import datetime, timedelta
-from glob import iglob, escape as glob_escape
+import fnmatch
+from glob import escape as glob_escape
 import os
+import re
+import tempfile
 from typing import Iterator, Iterable, Sequence
 
-from .archive import Archive, InvalidArchive
+from cached_property import cached_property
+
+from .archive import Archive, InvalidArchive, is_archive_file_name
+from .box_index import BoxIndex, IndexUnavailable
 from . import spec as bead_spec
-from .tech.timestamp import time_from_timestamp
 from .import tech
 Path = tech.fs.Path
 
 
-# private and specific to Box implementation, when Box gains more power,
-# it should change how it handles queries (e.g. using BEAD_NAME, KIND,
-# or CONTENT_ID directly through an index)
+# private and specific to Box implementation:
+# queries are answered by the box index (see box_index.py),
+# the conditions are checked below only when the index is not available
+
 
+def _check(bead, check_type, check_param):
+    if check_type == bead_spec.BEAD_NAME:
+        return bead.name == check_param
+    if check_type == bead_spec.KIND:
+        return bead.kind == check_param
+    if check_type == bead_spec.CONTENT_ID:
+        return bead.content_id.startswith(check_param)
+    raise ValueError(check_type)
 
-def _make_checkers():
-    def has_name(name):
-        def filter(bead):
-            return bead.name == name
-        return filter
 
-    def has_kind(kind):
-        def filter(bead):
-            return bead.kind == kind
-        return filter
+# relative cost of the checks:
+# the name comes from the file name, kind is in the archive meta (or .xmeta cache),
+# content_id might need hashing the manifest in the archive
+_CHECK_COSTS = {
+    bead_spec.BEAD_NAME:  0,
+    bead_spec.KIND:       1,
+    bead_spec.CONTENT_ID: 2,
+}
 
-    def has_content_prefix(prefix):
-        def filter(bead):
-            return bead.content_id.startswith(prefix)
-        return filter
 
-    return {
-        bead_spec.BEAD_NAME:  has_name,
-        bead_spec.KIND:       has_kind,
-        bead_spec.CONTENT_ID: has_content_prefix,
-    }
+def _check_cost(condition):
+    check_type, _ = condition
+    return _CHECK_COSTS[check_type]
 
 
-_CHECKERS = _make_checkers()
+def _match_all(bead):
+    return True
 
 
 def compile_conditions(conditions):
     '''
     Compile list of (check-type, check-param)-s into a match function.
+
+    Conditions are conjunctive, so they are checked cheapest first.
     '''
-    checkers = [_CHECKERS[check_type](check_param) for check_type, check_param in conditions]
+    conditions = sorted(conditions, key=_check_cost)
+    if not conditions:
+        return _match_all
 
     def match(bead):
-        for check in checkers:
-            if not check(bead):
+        for check_type, check_param in conditions:
+            if not _check(bead, check_type, check_param):
                 return False
         return True
     return match
 
 
+# beadname_20170615T075813302092+0200.zip
+_TIMESTAMP_GLOB = (
+    '_' + '[0-9]' * 8 + 'T' + '[0-9]' * 12 + '[-+]' + '[0-9]' * 4 + '.zip')
+
+
+def _archive_glob(conditions):
+    '''
+    Push down what the file name can answer into a glob pattern.
+
+    Archive file names encode the bead name and freeze time, so
+    BEAD_NAME conditions narrow the candidate files without opening them.
+    The remaining conditions need archive metadata.
+    Without a name, all files are candidates - archives can have other extensions than .zip.
+
+    Returns None if no file can match.
+    '''
+    bead_names = set(
+        value
+        for tag, value in conditions
+        if tag == bead_spec.BEAD_NAME)
+    if len(bead_names) > 1:
+        # easy path: names disagree
+        return None
+    if bead_names:
+        return glob_escape(bead_names.pop()) + _TIMESTAMP_GLOB
+    return '*'
+
+
+def _link_new(source, target):
+    '''
+    Make file source available also as target, that must not exist.
+
+    Raises FileExistsError instead of overwriting target (e.g. stored by another process).
+    '''
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        raise
+    except OSError:
+        # not all file systems support hard links
+        if os.path.exists(target):
+            raise FileExistsError(target)
+        os.replace(source, target)
+
+
 ARCHIVE_COMMENT = '''
 This file is a BEAD zip archive.
 
@@ -97,6 +154,7 @@ There {is,will be,was} more info about BEADs at
 ----
 
 '''
+_ARCHIVE_COMMENT_BYTES = ARCHIVE_COMMENT.encode('utf-8')
 
 
 class Box:
@@ -107,8 +165,10 @@ class Box:
     def __init__(self, name=None, location=None):
         self.location = location
         self.name = name
+        # (directory mtime, archive file names) - used when there is no box index
+        self._listing = (None, ())
 
-    @property
+    @cached_property
     def directory(self):
         '''
         Location as a Path.
@@ -117,9 +177,23 @@ class Box:
         '''
         return Path(self.location)
 
+    @cached_property
+    def _index(self):
+        return BoxIndex(self.directory)
+
+    def close(self):
+        '''
+        Close the box index.
+
+        The box remains usable, the index is opened again when needed.
+        '''
+        if '_index' in self.__dict__:
+            self._index.close()
+
     def find_bead(self, name, content_id):
-        query = ((bead_spec.BEAD_NAME, name), (bead_spec.CONTENT_ID, content_id))
-        for bead in self._beads(query):
+        conditions = ((bead_spec.BEAD_NAME, name), (bead_spec.CONTENT_ID, content_id))
+        beads = self._beads(conditions, lambda index: index.query(conditions, limit=1))
+        for bead in beads:
             return bead
 
     def all_beads(self) -> Iterator[Archive]:
@@ -128,30 +202,74 @@ class Box:
         '''
         return iter(self._beads([]))
 
-    def _beads(self, conditions) -> Iterable[Archive]:
+    def _beads(self, conditions, query=None) -> Iterable[Archive]:
         '''
         Retrieve matching beads.
+
+        The box index is searched with query(index), defaulting to all matching beads.
+        Without an index, archive files are checked against conditions.
         '''
-        match = compile_conditions(conditions)
-
-        bead_names = set(
-            value
-            for tag, value in conditions
-            if tag == bead_spec.BEAD_NAME)
-        if bead_names:
-            if len(bead_names) > 1:
-                # easy path: names disagree
-                return []
-            # beadname_20170615T075813302092+0200.zip
-            glob = bead_names.pop() + '_????????T????????????[-+]????.zip'
-        else:
-            glob = '*'
+        if query is None:
+            def query(index):
+                return index.query(conditions)
+        beads = self._query_index(query)
+        if beads is None:
+            return self._beads_from_files(conditions)
+        return beads
+
+    def _query_index(self, query):
+        '''
+        Run query on the synced box index.
 
-        paths = iglob(Path(glob_escape(self.directory)) / glob)
+        Returns None if the index is not available
+        - it is just a cache, that might be unavailable (e.g. read only box).
+        '''
+        try:
+            self._index.sync()
+            found = query(self._index)
+        except IndexUnavailable:
+            return None
+        return [
+            Archive(path, self.name, metadata, has_cache_file)
+            for path, metadata, has_cache_file in found]
+
+    def _beads_from_files(self, conditions) -> Iterable[Archive]:
+        glob = _archive_glob(conditions)
+        if glob is None:
+            return []
+        # the glob has already matched the bead name
+        match = compile_conditions(
+            (check_type, check_param)
+            for check_type, check_param in conditions
+            if check_type != bead_spec.BEAD_NAME)
+
+        paths = self._archive_paths(glob)
         beads = self._archives_from(paths)
         candidates = (bead for bead in beads if match(bead))
         return candidates
 
+    def _archive_paths(self, glob):
+        match = re.compile(fnmatch.translate(glob)).match
+        for file_name in self._archive_file_names():
+            if is_archive_file_name(file_name) and match(file_name):
+                yield self.directory / file_name
+
+    def _archive_file_names(self):
+        '''
+        File names in the box directory, listed again only when the directory has changed.
+        '''
+        try:
+            directory_mtime_ns = os.stat(self.directory).st_mtime_ns
+            listed_mtime_ns, file_names = self._listing
+            if listed_mtime_ns != directory_mtime_ns:
+                with os.scandir(self.directory) as entries:
+                    file_names = tuple(entry.name for entry in entries)
+                if tech.fs.is_mtime_settled(directory_mtime_ns):
+                    self._listing = (directory_mtime_ns, file_names)
+            return file_names
+        except FileNotFoundError:
+            return ()
+
     def _archives_from(self, paths):
         for path in paths:
             try:
@@ -164,9 +282,22 @@ class Box:
 
     def store(self, workspace, freeze_time):
         # -> Bead
-        zipfilename = (
-            self.directory / f'{workspace.name}_{freeze_time}.zip')
-        workspace.pack(zipfilename, freeze_time=freeze_time, comment=ARCHIVE_COMMENT)
+        file_name = f'{workspace.name}_{freeze_time}.zip'
+        zipfilename = self.directory / file_name
+        assert not os.path.exists(zipfilename)
+        # the archive appears under its name only when complete:
+        # partial archives are not seen by box queries (even from other processes)
+        # - it is packed in a new, hidden directory, that is removed even when interrupted
+        partial_directory = tempfile.mkdtemp(
+            dir=self.directory, prefix=f'.{file_name}.', suffix='.partial')
+        try:
+            partial_zipfilename = Path(partial_directory) / file_name
+            workspace.pack(
+                partial_zipfilename, freeze_time=freeze_time, comment=_ARCHIVE_COMMENT_BYTES)
+            _link_new(partial_zipfilename, zipfilename)
+        finally:
+            tech.fs.rmtree(partial_directory)
+        self._listing = (None, ())
         return zipfilename
 
     def find_names(self, kind, content_id, timestamp):
@@ -179,13 +310,7 @@ class Box:
             names                  = sequence of names (kind matched)
         '''
         assert isinstance(timestamp, datetime)
-        try:
-            filenames = os.listdir(self.directory)
-        except FileNotFoundError:
-            filenames = []
-        paths = (self.directory / fname for fname in filenames)
-        beads = self._archives_from(paths)
-        candidates = (bead for bead in beads if bead.kind == kind)
+        candidates = self._beads([(bead_spec.KIND, kind)])
 
         exact_match            = None
         best_guess             = None
@@ -196,7 +321,7 @@ class Box:
             if bead.content_id == content_id:
                 exact_match = bead.name
             #
-            bead_freeze_time = time_from_timestamp(bead.freeze_time_str)
+            bead_freeze_time = bead.freeze_time
             bead_timedelta = bead_freeze_time - timestamp
             if bead_timedelta < timedelta():
                 bead_timedelta = -bead_timedelta
@@ -220,7 +345,8 @@ class Box:
         # in theory timestamps can be [intentionally] duplicated, but let's
         # treat that as an error condition to be fixed ASAP
         conditions = [(check_type, check_param)]
-        return make_context(time, self._beads(conditions))
+        beads = self._beads(conditions, lambda index: index.query_context(conditions, time))
+        return make_context(time, beads)
 
 
 class UnionBox:
@@ -228,14 +354,15 @@ class UnionBox:
         self.boxes = tuple(boxes)
 
     def get_context(self, check_type, check_param, time):
-        context = None
-        for box in self.boxes:
+        def get_box_context(box):
             try:
-                box_context = box.get_context(check_type, check_param, time)
+                return box.get_context(check_type, check_param, time)
             except LookupError:
-                continue
-            else:
-                context = merge_contexts(box_context, context)
+                return None
+
+        context = None
+        for box_context in tech.parallel.parallel_map(get_box_context, self.boxes):
+            context = merge_contexts(box_context, context)
 
         if context:
             return context
@@ -0,0 +1,426 @@
+'''
+Index of the beads stored in a box directory.
+
+Answering queries by kind or content_id needs the metadata of every archive in the box,
+which is slow for big boxes - especially on network file systems.
+
+The index is an SQLite database next to the archives, storing their metadata,
+so that queries are answered without opening the archives.
+It is only a cache: it is brought in sync with the archive files before queries,
+and it can be deleted at any time.
+'''
+
+import contextlib
+import itertools
+from datetime import datetime, timedelta, timezone
+from glob import escape as glob_escape
+import os
+import sqlite3
+import threading
+import weakref
+
+from .archive import Archive, CACHE_CONTENT_ID, is_archive_file_name
+from . import meta
+from . import spec as bead_spec
+from . import tech
+from .tech.timestamp import time_from_timestamp
+
+persistence = tech.persistence
+Path = tech.fs.Path
+
+__all__ = ('BoxIndex', 'IndexUnavailable', 'INDEX_FILE_NAME')
+
+
+INDEX_FILE_NAME = '.index.sqlite'
+
+
+# increment on incompatible schema changes (or changes in what is indexed) - the index is rebuilt
+_SCHEMA_VERSION = 6
+
+# freeze_time_us: microseconds since the Unix epoch (UTC), as freeze_time can not be ordered
+# (it is local time with a time zone)
+# has_cache_file: whether the archive has an .xmeta cache file next to it
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS beads (
+        file_name       TEXT PRIMARY KEY,
+        name            TEXT NOT NULL,
+        freeze_time_us  INTEGER NOT NULL,
+        has_cache_file  INTEGER NOT NULL,
+        meta_version    TEXT NOT NULL,
+        kind            TEXT NOT NULL,
+        content_id      TEXT NOT NULL,
+        freeze_time     TEXT NOT NULL,
+        inputs          TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS rejected (
+        file_name   TEXT PRIMARY KEY,
+        mtime_ns    INTEGER NOT NULL,
+        size        INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS synced (
+        directory_mtime_ns  INTEGER NOT NULL
+    );
+'''
+_TABLES = ('beads', 'rejected', 'synced')
+
+# indexes of the conditions used in queries
+# - ordered by freeze time (where the condition is equality), so that
+#   query_context finds the neighbours of a time without sorting
+_INDEXES = {
+    'beads_name':       'beads (name, freeze_time_us)',
+    'beads_kind':       'beads (kind, freeze_time_us)',
+    'beads_content_id': 'beads (content_id)',
+}
+
+# metadata columns, named after the Archive cache keys they are loaded into
+_META_COLUMNS = (
+    meta.META_VERSION,
+    meta.KIND,
+    CACHE_CONTENT_ID,
+    meta.FREEZE_TIME,
+    meta.INPUTS,
+)
+
+_SELECT = 'SELECT file_name, has_cache_file, ' + ', '.join(_META_COLUMNS) + ' FROM beads'
+
+_INSERT = (
+    'INSERT OR REPLACE INTO beads (file_name, name, freeze_time_us, has_cache_file, '
+    + ', '.join(_META_COLUMNS) + ')'
+    ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _microseconds(time):
+    return (time - _EPOCH) // _MICROSECOND
+
+
+def _prefix_pattern(prefix):
+    return glob_escape(prefix) + '*'
+
+
+# check-type -> (SQL condition, parameter conversion or None)
+_CONDITIONS = {
+    bead_spec.BEAD_NAME:  ('name = ?',          None),
+    bead_spec.KIND:       ('kind = ?',          None),
+    bead_spec.CONTENT_ID: ('content_id GLOB ?', _prefix_pattern),
+}
+
+
+def _where(conditions):
+    '''
+    Translate (check-type, check-param)-s into an SQL WHERE clause and its parameters.
+    '''
+    clauses = []
+    parameters = []
+    for check_type, check_param in conditions:
+        clause, make_parameter = _CONDITIONS[check_type]
+        clauses.append(clause)
+        parameters.append(make_parameter(check_param) if make_parameter else check_param)
+    if clauses:
+        return ' WHERE ' + ' AND '.join(clauses), parameters
+    return '', parameters
+
+
+def _stat_key(path):
+    '''
+    -> (mtime_ns, size) of path, or None if it does not exist
+    '''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _list_box(directory):
+    '''
+    -> (archive file names, archive file names having an .xmeta cache file)
+    '''
+    file_names = os.listdir(directory)
+    archives = set(file_name for file_name in file_names if is_archive_file_name(file_name))
+    cached = set(
+        file_name[:-len('.xmeta')] + '.zip'
+        for file_name in file_names
+        if file_name.endswith('.xmeta'))
+    return archives, archives & cached
+
+
+class IndexUnavailable(Exception):
+    '''The box index can not be used (e.g. the box is read only)'''
+
+
+class BoxIndex:
+    '''
+    Metadata of the archives in a box directory.
+    '''
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.index_path = self.directory / INDEX_FILE_NAME
+        # a single connection, kept open between operations and shared by threads
+        self._conn = None
+        # closes the connection, also when the index is garbage collected without close()
+        self._finalizer = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._finalizer()
+            self._conn = None
+
+    @contextlib.contextmanager
+    def _connection(self):
+        with self._lock:
+            try:
+                conn = self._open()
+                with conn:
+                    yield conn
+            except (sqlite3.OperationalError, OSError) as e:
+                raise IndexUnavailable(self.index_path) from e
+            except sqlite3.DatabaseError as e:
+                # damaged (e.g. "database disk image is malformed") - as it is just a cache,
+                # it is removed, and built again by the next sync
+                self._close()
+                try:
+                    self._remove()
+                except OSError:
+                    # e.g. still open by another process (Windows)
+                    pass
+                raise IndexUnavailable(self.index_path) from e
+
+    def _open(self):
+        if self._conn is not None:
+            try:
+                # also notices, if the index was damaged since the last operation
+                self._ensure_schema(self._conn)
+                return self._conn
+            except sqlite3.OperationalError:
+                raise
+            except sqlite3.DatabaseError:
+                self._close()
+        self._conn = self._connect()
+        self._finalizer = weakref.finalize(self, self._conn.close)
+        return self._conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        try:
+            self._configure(conn)
+            self._ensure_schema(conn)
+        except sqlite3.OperationalError:
+            conn.close()
+            raise
+        except sqlite3.DatabaseError:
+            # not a database (e.g. damaged) - as it is just a cache, start a new one
+            conn.close()
+            self._remove()
+            conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            self._configure(conn)
+            self._ensure_schema(conn)
+        return conn
+
+    def _configure(self, conn):
+        # keep the journal file, its creation and deletion would change the mtime
+        # of the box directory, which is used to detect changes
+        conn.execute('PRAGMA journal_mode = PERSIST')
+        # the index is a cache, that is rebuilt when damaged:
+        # it does not need to survive power loss, but syncing should be fast
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA temp_store = MEMORY')
+
+    def _remove(self):
+        for path in (self.index_path, self.index_path + '-journal'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _ensure_schema(self, conn):
+        schema_version, = conn.execute('PRAGMA user_version').fetchone()
+        if schema_version == _SCHEMA_VERSION:
+            return
+        for table in _TABLES:
+            conn.execute(f'DROP TABLE IF EXISTS {table}')
+        conn.executescript(_SCHEMA)
+        self._create_indexes(conn)
+        # the version is set last: an interrupted schema creation is redone
+        conn.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+
+    def _create_indexes(self, conn):
+        for index, definition in _INDEXES.items():
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {index} ON {definition}')
+
+    def _drop_indexes(self, conn):
+        for index in _INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {index}')
+
+    def sync(self):
+        '''
+        Bring the index in sync with the archive files in the box directory.
+
+        Archives are not expected to change, only to appear or disappear,
+        so only new files are read.
+        Invalid archives are remembered, and read again only if they change
+        (e.g. they were read while being copied).
+        The directory is not even listed, if its modification time is the same
+        as at the previous sync.
+        '''
+        with self._connection() as conn:
+            directory_mtime_ns = os.stat(self.directory).st_mtime_ns
+            synced = conn.execute('SELECT directory_mtime_ns FROM synced').fetchone()
+            if synced == (directory_mtime_ns,):
+                return
+            # listing and reading the new archives is slow,
+            # it is done before taking the write lock
+            present, cached = _list_box(self.directory)
+            indexed = set(file_name for file_name, in conn.execute('SELECT file_name FROM beads'))
+            rejected = self._rejected(conn, present)
+            added = present - indexed - rejected
+            # the records are kept until the write lock is taken - None for invalid archives
+            records = tech.parallel.parallel_map(
+                lambda file_name: self._read_record(file_name, file_name in cached), added)
+            invalid = added - set(record[0] for record in records if record is not None)
+            # concurrent syncs are serialized, instead of failing to upgrade their read locks
+            conn.execute('BEGIN IMMEDIATE')
+            self._update(conn, present, cached, records, rejected, invalid)
+            conn.execute('DELETE FROM synced')
+            if tech.fs.is_mtime_settled(directory_mtime_ns):
+                conn.execute('INSERT INTO synced VALUES (?)', (directory_mtime_ns,))
+
+    def _rejected(self, conn, present):
+        '''
+        Names of the remembered invalid archives, that are present and unchanged.
+        '''
+        return set(
+            file_name
+            for file_name, mtime_ns, size in conn.execute(
+                'SELECT file_name, mtime_ns, size FROM rejected')
+            if file_name in present and _stat_key(self.directory / file_name) == (mtime_ns, size))
+
+    def _update(self, conn, present, cached, records, rejected, invalid):
+        '''
+        Write the changes found by sync.
+
+        The index is read again, as another process might have synced it in the meantime.
+        '''
+        indexed = dict(conn.execute('SELECT file_name, has_cache_file FROM beads'))
+        removed = indexed.keys() - present
+        conn.executemany(
+            'DELETE FROM beads WHERE file_name = ?',
+            ((file_name,) for file_name in removed))
+        # .xmeta files are written also for already indexed archives
+        conn.executemany(
+            'UPDATE beads SET has_cache_file = ? WHERE file_name = ?',
+            (
+                (file_name in cached, file_name)
+                for file_name in indexed.keys() & present
+                if indexed[file_name] != (file_name in cached)))
+        # a new index is filled faster without maintaining the secondary indexes
+        building = not indexed and not rejected
+        if building:
+            self._drop_indexes(conn)
+        inserted = conn.executemany(
+            _INSERT,
+            (
+                record
+                for record in records
+                if record is not None and record[0] not in indexed)).rowcount
+        if building:
+            self._create_indexes(conn)
+        # forget the invalid archives, that have changed or disappeared
+        # (collected before deleting, not to delete from the table while reading it)
+        forgotten = set(
+            file_name for file_name, in conn.execute('SELECT file_name FROM rejected')) - rejected
+        conn.executemany(
+            'DELETE FROM rejected WHERE file_name = ?',
+            ((file_name,) for file_name in forgotten))
+        self._reject(conn, invalid)
+        # statistics for the query planner (choosing between the indexes)
+        if building:
+            conn.execute('ANALYZE')
+        elif removed or inserted:
+            conn.execute('PRAGMA optimize')
+
+    def _reject(self, conn, file_names):
+        for file_name in file_names:
+            stat_key = _stat_key(self.directory / file_name)
+            if stat_key is not None:
+                conn.execute(
+                    'INSERT OR REPLACE INTO rejected VALUES (?, ?, ?)', (file_name, *stat_key))
+
+    def _read_record(self, file_name, has_cache_file):
+        try:
+            archive = Archive(self.directory / file_name, has_cache_file=has_cache_file)
+            # make sure, that all metadata is in the cache
+            archive.meta_version, archive.kind, archive.content_id
+            archive.freeze_time_str, archive.inputs
+            cache = archive.cache
+            return (
+                file_name,
+                archive.name,
+                _microseconds(time_from_timestamp(cache[meta.FREEZE_TIME])),
+                has_cache_file,
+                cache[meta.META_VERSION],
+                cache[meta.KIND],
+                cache[CACHE_CONTENT_ID],
+                cache[meta.FREEZE_TIME],
+                persistence.dumps_compact(cache[meta.INPUTS]))
+        except Exception:
+            # not a bead (or a damaged one, e.g. without manifest or with a malformed
+            # freeze time) - it is simply not indexed, and must not break queries
+            return None
+
+    def query(self, conditions, limit=None):
+        '''
+        Find archives matching all the (check-type, check-param) conditions.
+
+        Returns a list of (path, metadata, has_cache_file) - at most limit of them, if given,
+        where metadata is suitable as an initial Archive cache,
+        and has_cache_file tells if the archive has an .xmeta cache file.
+        '''
+        where, parameters = _where(conditions)
+        if limit is not None:
+            where += ' LIMIT ?'
+            parameters.append(limit)
+        with self._connection() as conn:
+            return [
+                self._found(row)
+                for row in conn.execute(_SELECT + where, parameters)]
+
+    def query_context(self, conditions, time):
+        '''
+        Find archives matching conditions, that are frozen closest to time.
+
+        These are the archives frozen exactly at time,
+        and the last one before and the first one after time.
+        Returns a list of (path, metadata, has_cache_file) as query().
+        '''
+        where, parameters = _where(conditions)
+        where = (where + ' AND ') if where else ' WHERE '
+        parameters.append(_microseconds(time))
+        with self._connection() as conn:
+            rows = itertools.chain(
+                conn.execute(
+                    _SELECT + where + 'freeze_time_us = ?',
+                    parameters),
+                conn.execute(
+                    _SELECT + where + 'freeze_time_us < ? ORDER BY freeze_time_us DESC LIMIT 1',
+                    parameters),
+                conn.execute(
+                    _SELECT + where + 'freeze_time_us > ? ORDER BY freeze_time_us LIMIT 1',
+                    parameters))
+            return [self._found(row) for row in rows]
+
+    def _found(self, row):
+        file_name, has_cache_file, *values = row
+        metadata = dict(zip(_META_COLUMNS, values))
+        metadata[meta.INPUTS] = persistence.loads(metadata[meta.INPUTS])
+        return self.directory / file_name, metadata, bool(has_cache_file)
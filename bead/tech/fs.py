@@ -4,6 +4,7 @@ import stat
 import contextlib
 import shutil
 import tempfile
+import time
 
 
 class Path(str):
@@ -20,6 +21,18 @@ class Path(str):
     __truediv__ = __div__
 
 
+# File systems with coarse time resolution might not change the modification time
+# for changes made right after a previous modification.
+_MTIME_SETTLE_NS = 10 * 10**9
+
+
+def is_mtime_settled(mtime_ns):
+    '''
+    Is the modification time old enough, that later changes will modify it?
+    '''
+    return time.time_ns() - mtime_ns > _MTIME_SETTLE_NS
+
+
 def ensure_directory(path):
     if not os.path.exists(path):
         os.makedirs(path)
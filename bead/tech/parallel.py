@@ -0,0 +1,30 @@
+'''
+Running IO bound work (reading archives or boxes) in parallel.
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+
+def io_parallelism():
+    '''
+    Number of archives (or boxes) to read at the same time.
+
+    Reading boxes is IO bound, on network file systems parallel reads can
+    hide latency, this can be enabled with the BEAD_BOX_IO_PARALLELISM environment variable.
+    '''
+    try:
+        return max(1, int(os.environ.get('BEAD_BOX_IO_PARALLELISM', 1)))
+    except ValueError:
+        return 1
+
+
+def parallel_map(function, items):
+    '''
+    -> list of function(item) for items, in order
+    '''
+    parallelism = io_parallelism()
+    if parallelism == 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        return list(executor.map(function, items))
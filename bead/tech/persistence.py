@@ -31,10 +31,22 @@ def loads(string):
     return json.loads(string)
 
 
+# for machine consumption only: smaller and faster to parse
+JSON_COMPACT_OPTIONS = dict(
+    separators=(',', ':'),
+    sort_keys=True,
+    ensure_ascii=True,
+)
+
+
 def dumps(content):
     return json.dumps(content, **JSON_SAVE_OPTIONS)
 
 
+def dumps_compact(content):
+    return json.dumps(content, **JSON_COMPACT_OPTIONS)
+
+
 def dump(content, ostream):
     json.dump(content, ostream, **JSON_SAVE_OPTIONS)
 
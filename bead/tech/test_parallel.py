@@ -0,0 +1,17 @@
+from ..test import TestCase, setenv
+from . import parallel as m
+
+
+class Test_parallel_map(TestCase):
+
+    def test_sequential(self):
+        with setenv('BEAD_BOX_IO_PARALLELISM', '1'):
+            assert [1, 4, 9] == m.parallel_map(lambda x: x * x, iter([1, 2, 3]))
+
+    def test_parallel(self):
+        with setenv('BEAD_BOX_IO_PARALLELISM', '3'):
+            assert [1, 4, 9] == m.parallel_map(lambda x: x * x, iter([1, 2, 3]))
+
+    def test_invalid_parallelism_is_sequential(self):
+        with setenv('BEAD_BOX_IO_PARALLELISM', 'many'):
+            assert 1 == m.io_parallelism()
@@ -23,6 +23,11 @@ class Test(TestCase):
         self.when_string_is_parsed_back()
         self.then_it_equals_the_original_structure()
 
+    def test_compact_strings(self):
+        self.given_a_persisted_structure_as_a_compact_string()
+        self.when_string_is_parsed_back()
+        self.then_it_equals_the_original_structure()
+
     # implementation
 
     __file = None
@@ -37,6 +42,9 @@ class Test(TestCase):
     def given_a_persisted_structure_as_a_string(self):
         self.__string = m.dumps(get_structure())
 
+    def given_a_persisted_structure_as_a_compact_string(self):
+        self.__string = m.dumps_compact(get_structure())
+
     def when_file_is_read_back(self):
         with open(self.__file, 'r') as f:
             self.__structure = m.load(f)
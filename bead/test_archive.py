@@ -30,6 +30,12 @@ class Test_Archive(TestCase):
         self.when_content_id_is_checked()
         self.then_content_id_is_a_string()
 
+    def test_replaced_bead_is_read_again(self):
+        self.given_a_bead()
+        self.when_content_id_is_checked()
+        self.when_bead_is_replaced_with_another_kind()
+        self.then_archive_has_the_new_kind()
+
     # implementation
 
     __bead = None
@@ -38,15 +44,18 @@ class Test_Archive(TestCase):
     __content_id = None
 
     def given_a_bead(self):
-        # yields an invalid BEAD (meta is simplified), sufficient for unit testing
         self.__bead = self.new_temp_dir() / 'bead.zip'
+        self.__write_bead(b'TEST-FAKE')
+
+    def __write_bead(self, kind):
+        # yields an invalid BEAD (meta is simplified), sufficient for unit testing
         with zipfile.ZipFile(self.__bead, 'w') as z:
             z.writestr(
                 layouts.Archive.BEAD_META,
                 b'''
                     {
                         "meta_version": "aaa947a6-1f7a-11e6-ba3a-0021cc73492e",
-                        "kind": "TEST-FAKE",
+                        "kind": "''' + kind + b'''",
                         "freeze_time": "20200913T173910000000+0000",
                         "inputs": {}
                     }
@@ -79,6 +88,14 @@ class Test_Archive(TestCase):
         bead = m.Archive(self.__bead)
         self.__content_id = bead.content_id
 
+    def when_bead_is_replaced_with_another_kind(self):
+        self.__write_bead(b'TEST-FAKE-2')
+        # make sure the stat of the replaced file differs even on coarse timestamps
+        os.utime(self.__bead, ns=(0, 0))
+
+    def then_archive_has_the_new_kind(self):
+        assert 'TEST-FAKE-2' == m.Archive(self.__bead).kind
+
     def then_content_id_is_a_string(self):
         assert isinstance(self.__content_id, str)
 
@@ -90,3 +107,17 @@ class Test_Archive(TestCase):
     def then_an_empty_directory_is_created(self):
         assert os.path.isdir(self.__extracteddir)
         assert [] == os.listdir(self.__extracteddir)
+
+
+class Test_bead_name_from_file_path(TestCase):
+
+    def test_timestamp_suffix_is_removed(self):
+        assert 'bead-2015v3' == m.bead_name_from_file_path('bead-2015v3.zip')
+        assert 'bead-2015v3' == m.bead_name_from_file_path('bead-2015v3_20150923.zip')
+        assert 'bead-2015v3' == m.bead_name_from_file_path(
+            'bead-2015v3_20150923T010203012345+0200.zip')
+        assert 'bead-2015v3' == m.bead_name_from_file_path(
+            'bead-2015v3_20150923T010203012345-0200.zip')
+
+    def test_directory_is_removed(self):
+        assert 'bead-2015v3' == m.bead_name_from_file_path('path/to/bead-2015v3_20150923.zip')
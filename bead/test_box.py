@@ -1,5 +1,9 @@
-from .test import TestCase
-from .box import Box
+import os
+import time
+
+from .test import TestCase, setenv
+from .box import Box, UnionBox
+from .box_index import INDEX_FILE_NAME
 from .tech.fs import write_file, rmtree
 from .tech.timestamp import time_from_user
 from .workspace import Workspace
@@ -11,6 +15,7 @@ class Test_box_with_beads(TestCase):
     # fixtures
     def box(self):
         box = Box('test', self.new_temp_dir())
+        self.addCleanup(box.close)
 
         def add_bead(name, kind, freeze_time):
             ws = Workspace(self.new_temp_dir() / name)
@@ -49,10 +54,64 @@ class Test_box_with_beads(TestCase):
         assert best_guess_timestamp is None
         assert [] == list(names)
 
+    def test_store_leaves_only_the_archive(self, box):
+        file_names = set(os.listdir(box.directory))
+        ws = Workspace(self.new_temp_dir() / 'bead4')
+        ws.create('test-bead4')
+        box.store(ws, '20160704T162800000000+0200')
+        assert {'bead4_20160704T162800000000+0200.zip'} == (
+            set(os.listdir(box.directory)) - file_names)
+
+    def test_store_after_interrupted_store(self, box):
+        file_names = set(os.listdir(box.directory))
+        ws = Workspace(self.new_temp_dir() / 'bead4')
+        ws.create('test-bead4')
+
+        def interrupted_pack(zipfilename, freeze_time, comment):
+            write_file(zipfilename, 'partial archive')
+            raise KeyboardInterrupt
+        ws.pack = interrupted_pack
+        self.assertRaises(KeyboardInterrupt, box.store, ws, '20160704T162800000000+0200')
+        del ws.pack
+        assert file_names == set(os.listdir(box.directory))
+
+        box.store(ws, '20160704T162800000000+0200')
+        assert ['bead4'] == [bead.name for bead in box.all_beads() if bead.kind == 'test-bead4']
+
+    def test_store_does_not_overwrite_archive_stored_meanwhile(self, box):
+        ws = Workspace(self.new_temp_dir() / 'bead4')
+        ws.create('test-bead4')
+        pack = ws.pack
+        archive = box.directory / 'bead4_20160704T162800000000+0200.zip'
+
+        def pack_while_another_process_stores(zipfilename, freeze_time, comment):
+            write_file(archive, 'stored by another process')
+            pack(zipfilename, freeze_time, comment)
+        ws.pack = pack_while_another_process_stores
+        self.assertRaises(FileExistsError, box.store, ws, '20160704T162800000000+0200')
+        with open(archive) as f:
+            assert 'stored by another process' == f.read()
+
+    def test_usable_after_close(self, box):
+        box.close()
+        assert set(['bead1', 'bead2', 'BEAD3']) == set(b.name for b in box.all_beads())
+
+    def test_archive_with_other_extension_is_found(self, box):
+        path, = (bead.archive_filename for bead in box.all_beads() if bead.name == 'bead1')
+        os.rename(path, os.path.splitext(path)[0] + '.bead')
+        assert set(['bead1', 'bead2', 'BEAD3']) == set(b.name for b in box.all_beads())
+
     def test_find_with_uppercase_name(self, box, timestamp):
         matches = box.get_context(bead_spec.BEAD_NAME, 'BEAD3', timestamp)
         assert 'BEAD3' == matches.best.name
 
+    def test_find_with_glob_special_characters_in_name(self, box, timestamp):
+        ws = Workspace(self.new_temp_dir() / 'bead[1]')
+        ws.create('test-bead4')
+        box.store(ws, '20160704T162800000000+0200')
+        matches = box.get_context(bead_spec.BEAD_NAME, 'bead[1]', timestamp)
+        assert 'bead[1]' == matches.best.name
+
 
 class Test_box_methods_tolerate_junk_in_box(Test_box_with_beads):
 
@@ -62,3 +121,66 @@ class Test_box_methods_tolerate_junk_in_box(Test_box_with_beads):
         # add junk
         write_file(box.directory / 'some-non-bead-file', 'random bits')
         return box
+
+
+class Test_box_without_index(Test_box_with_beads):
+
+    # fixtures
+    def box(self):
+        box = Test_box_with_beads.box(self)
+        # the index can not be created
+        os.mkdir(box.directory / INDEX_FILE_NAME)
+        return box
+
+    # tests
+    def test_archive_stored_by_other_box_is_found(self, box):
+        an_hour_ago = int(time.time()) - 3600
+        os.utime(box.directory, (an_hour_ago, an_hour_ago))
+        assert 3 == len(list(box.all_beads()))
+
+        ws = Workspace(self.new_temp_dir() / 'bead4')
+        ws.create('test-bead4')
+        other_box = Box('other', box.location)
+        self.addCleanup(other_box.close)
+        other_box.store(ws, '20160704T162800000000+0200')
+        assert 4 == len(list(box.all_beads()))
+
+
+class Test_union_box(TestCase):
+
+    # fixtures
+    def boxes(self):
+        def new_box(name):
+            box = Box(name, self.new_temp_dir())
+            self.addCleanup(box.close)
+            return box
+
+        def box_with_bead(freeze_time):
+            box = new_box('test')
+            ws = Workspace(self.new_temp_dir() / 'bead')
+            ws.create('test-bead')
+            box.store(ws, freeze_time)
+            return box
+
+        return [
+            box_with_bead('20160704T000000000000+0200'),
+            new_box('empty'),
+            box_with_bead('20160704T162800000000+0200'),
+        ]
+
+    # tests
+    def test_get_at(self, boxes):
+        time = time_from_user('20160704T160000000000+0200')
+        bead = UnionBox(boxes).get_at(bead_spec.BEAD_NAME, 'bead', time)
+        assert time_from_user('20160704T162800000000+0200') == bead.freeze_time
+
+    def test_get_at_with_parallel_box_reads(self, boxes):
+        time = time_from_user('20160704T010000000000+0200')
+        with setenv('BEAD_BOX_IO_PARALLELISM', '3'):
+            bead = UnionBox(boxes).get_at(bead_spec.BEAD_NAME, 'bead', time)
+        assert time_from_user('20160704T000000000000+0200') == bead.freeze_time
+
+    def test_get_at_not_found(self, boxes):
+        time = time_from_user('20160704T010000000000+0200')
+        self.assertRaises(
+            LookupError, UnionBox(boxes).get_at, bead_spec.BEAD_NAME, 'no-such-bead', time)
@@ -0,0 +1,254 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import sqlite3
+import time
+import zipfile
+
+from .test import TestCase, setenv
+from .archive import Archive
+from .box import Box
+from .box_index import BoxIndex, IndexUnavailable, INDEX_FILE_NAME
+from .tech.fs import write_file
+from .tech.timestamp import time_from_timestamp
+from .workspace import Workspace
+from . import layouts
+from . import spec as bead_spec
+from . import zipopener
+
+
+class Test_box_index(TestCase):
+
+    # fixtures
+    def box(self):
+        box = Box('test', self.new_temp_dir())
+        self.addCleanup(box.close)
+        self.add_bead(box, 'bead1', 'test-bead1', '20160704T000000000000+0200')
+        self.add_bead(box, 'bead2', 'test-bead2', '20160704T162800000000+0200')
+        self.add_bead(box, 'bead2', 'test-bead2', '20160704T162800000001+0200')
+        write_file(box.directory / 'junk.zip', 'not a zip archive')
+        return box
+
+    def add_bead(self, box, name, kind, freeze_time):
+        ws = Workspace(self.new_temp_dir() / name)
+        ws.create(kind)
+        box.store(ws, freeze_time)
+
+    def add_damaged_bead(self, box, file_name, freeze_time, manifest):
+        with zipfile.ZipFile(box.directory / file_name, 'w') as z:
+            z.writestr(
+                layouts.Archive.BEAD_META,
+                '''
+                    {
+                        "meta_version": "aaa947a6-1f7a-11e6-ba3a-0021cc73492e",
+                        "kind": "test-damaged",
+                        "freeze_time": "%s",
+                        "inputs": {}
+                    }
+                ''' % freeze_time)
+            if manifest:
+                z.writestr(layouts.Archive.MANIFEST, '{}')
+
+    def damage_pages(self, index_path):
+        with open(index_path, 'r+b') as f:
+            header = f.read(100)
+            page_size = int.from_bytes(header[16:18], 'big')
+            size = f.seek(0, os.SEEK_END)
+            # keep the first page with the header and the schema
+            f.seek(page_size)
+            f.write(b'\xff' * (size - page_size))
+
+    def make_directory_old(self, box):
+        an_hour_ago = int(time.time()) - 3600
+        os.utime(box.directory, ns=(an_hour_ago * 10**9, an_hour_ago * 10**9))
+
+    def index(self, box):
+        index = BoxIndex(box.directory)
+        self.addCleanup(index.close)
+        index.sync()
+        return index
+
+    def kinds(self, found):
+        return sorted(metadata['kind'] for _, metadata, _ in found)
+
+    # tests
+    def test_query_by_name(self, index):
+        assert ['test-bead2', 'test-bead2'] == self.kinds(
+            index.query([(bead_spec.BEAD_NAME, 'bead2')]))
+
+    def test_query_by_kind_and_content_id_prefix(self, index):
+        (path, metadata, _), = index.query([(bead_spec.KIND, 'test-bead1')])
+        found = index.query([
+            (bead_spec.KIND, 'test-bead1'),
+            (bead_spec.CONTENT_ID, metadata['content_id'][:3])])
+        assert [path] == [path for path, _, _ in found]
+
+    def test_query_limit(self, index):
+        assert 1 == len(index.query([(bead_spec.BEAD_NAME, 'bead2')], limit=1))
+
+    def test_content_id_prefix_is_not_a_glob(self, index):
+        assert [] == index.query([(bead_spec.CONTENT_ID, '*')])
+
+    def test_query_does_not_read_archives(self, index):
+        for path, _, _ in index.query([]):
+            write_file(path, '')
+        assert ['test-bead1', 'test-bead2', 'test-bead2'] == self.kinds(index.query([]))
+
+    def test_removed_archive_is_dropped_by_sync(self, box, index):
+        path, = (path for path, _, _ in index.query([(bead_spec.KIND, 'test-bead1')]))
+        os.remove(path)
+        index.sync()
+        assert ['test-bead2', 'test-bead2'] == self.kinds(index.query([]))
+
+    def test_query_context(self, index):
+        # the same time as the first bead2, but in a different time zone
+        time = time_from_timestamp('20160704T142800000000+0000')
+        found = index.query_context([(bead_spec.BEAD_NAME, 'bead2')], time)
+        assert [
+            '20160704T162800000000+0200',
+            '20160704T162800000001+0200',
+        ] == sorted(metadata['freeze_time'] for _, metadata, _ in found)
+
+    def test_parallel_sync(self, box):
+        index = BoxIndex(box.directory)
+        self.addCleanup(index.close)
+        with setenv('BEAD_BOX_IO_PARALLELISM', '4'):
+            index.sync()
+        assert ['test-bead1', 'test-bead2', 'test-bead2'] == self.kinds(index.query([]))
+
+    def test_damaged_index_is_rebuilt(self, box, index):
+        write_file(index.index_path, 'not an sqlite database')
+        index.sync()
+        assert ['test-bead1', 'test-bead2', 'test-bead2'] == self.kinds(index.query([]))
+
+    def test_index_that_can_not_be_created_is_unavailable(self, box):
+        os.mkdir(box.directory / INDEX_FILE_NAME)
+        index = BoxIndex(box.directory)
+        self.addCleanup(index.close)
+        self.assertRaises(IndexUnavailable, index.sync)
+
+    def test_index_with_damaged_pages_is_rebuilt(self, box, index):
+        index.close()
+        self.damage_pages(index.index_path)
+        self.assertRaises(IndexUnavailable, index.sync)
+        index.sync()
+        assert ['test-bead1', 'test-bead2', 'test-bead2'] == self.kinds(index.query([]))
+
+    def test_box_with_damaged_index_is_searched(self, box, index):
+        index.close()
+        self.damage_pages(index.index_path)
+        assert 3 == len(list(box.all_beads()))
+
+    def test_new_archive_is_indexed(self, box, index):
+        self.make_directory_old(box)
+        index.sync()
+        self.add_bead(box, 'bead3', 'test-bead3', '20160704T162800000000+0200')
+        index.sync()
+        assert 1 == len(index.query([(bead_spec.KIND, 'test-bead3')]))
+
+    def test_unchanged_directory_is_not_listed(self, box, index):
+        self.make_directory_old(box)
+        index.sync()
+        mtime_ns = os.stat(box.directory).st_mtime_ns
+        self.add_bead(box, 'bead3', 'test-bead3', '20160704T162800000000+0200')
+        # hide the change
+        os.utime(box.directory, ns=(mtime_ns, mtime_ns))
+        index.sync()
+        assert [] == index.query([(bead_spec.KIND, 'test-bead3')])
+
+    def test_archives_are_opened_once(self, box):
+        opened_file_names = []
+        zip_file = zipopener.ZipFile
+
+        def tracked_zip_file(file_name):
+            opened_file_names.append(os.path.basename(file_name))
+            return zip_file(file_name)
+        zipopener.ZipFile = tracked_zip_file
+        try:
+            index = BoxIndex(box.directory)
+            self.addCleanup(index.close)
+            index.sync()
+        finally:
+            zipopener.ZipFile = zip_file
+        assert sorted(set(opened_file_names)) == sorted(opened_file_names)
+        assert 4 == len(opened_file_names)
+
+    def test_damaged_archives_are_not_indexed(self, box):
+        self.add_damaged_bead(
+            box, 'odd_20160704T162800000000+0200.zip', '20160704T162800000000+0200',
+            manifest=False)
+        self.add_damaged_bead(
+            box, 'odder_20160704T162800000000+0200.zip', 'yesterday', manifest=True)
+        index = self.index(box)
+        assert ['test-bead1', 'test-bead2', 'test-bead2'] == self.kinds(index.query([]))
+
+    def test_invalid_archive_is_not_read_again(self, box, index):
+        read_file_names = []
+        read_record = index._read_record
+
+        def tracked_read_record(file_name, has_cache_file):
+            read_file_names.append(file_name)
+            return read_record(file_name, has_cache_file)
+        index._read_record = tracked_read_record
+
+        self.add_bead(box, 'bead3', 'test-bead3', '20160704T162800000000+0200')
+        index.sync()
+        assert ['bead3_20160704T162800000000+0200.zip'] == read_file_names
+
+    def test_changed_invalid_archive_is_read_once(self, box, index):
+        write_file(box.directory / 'junk.zip', 'still not a zip archive')
+        index.sync()
+        read_file_names = []
+        read_record = index._read_record
+
+        def tracked_read_record(file_name, has_cache_file):
+            read_file_names.append(file_name)
+            return read_record(file_name, has_cache_file)
+        index._read_record = tracked_read_record
+
+        self.add_bead(box, 'bead3', 'test-bead3', '20160704T162800000000+0200')
+        index.sync()
+        assert ['bead3_20160704T162800000000+0200.zip'] == read_file_names
+
+    def test_archives_are_read_without_the_write_lock(self, box):
+        index = BoxIndex(box.directory)
+        self.addCleanup(index.close)
+        read_record = index._read_record
+
+        def read_record_while_writing(file_name, has_cache_file):
+            conn = sqlite3.connect(index.index_path, timeout=0)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.rollback()
+            finally:
+                conn.close()
+            return read_record(file_name, has_cache_file)
+        index._read_record = read_record_while_writing
+
+        index.sync()
+        assert ['test-bead1', 'test-bead2', 'test-bead2'] == self.kinds(index.query([]))
+
+    def test_changed_invalid_archive_is_read_again(self, box, index):
+        (path, _, _), = index.query([(bead_spec.KIND, 'test-bead1')])
+        shutil.copy(path, box.directory / 'junk.zip')
+        index.sync()
+        assert 2 == len(index.query([(bead_spec.KIND, 'test-bead1')]))
+
+    def test_cache_file_is_tracked(self, index):
+        assert [False, False, False] == [
+            has_cache_file for _, _, has_cache_file in index.query([])]
+        (path, _, _), = index.query([(bead_spec.KIND, 'test-bead1')])
+        Archive(path).save_cache()
+        index.sync()
+        assert [(path, True)] == [
+            (path, has_cache_file)
+            for path, _, has_cache_file in index.query([(bead_spec.KIND, 'test-bead1')])]
+
+    def test_used_from_another_thread(self, index):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            found = executor.submit(index.query, []).result()
+        assert ['test-bead1', 'test-bead2', 'test-bead2'] == self.kinds(found)
+
+    def test_usable_after_close(self, index):
+        index.close()
+        assert ['test-bead1', 'test-bead2', 'test-bead2'] == self.kinds(index.query([]))
@@ -111,6 +111,8 @@ class Workspace(Bead):
     def pack(self, zipfilename, freeze_time, comment):
         '''
         Create archive from workspace.
+
+        comment is either a str or utf-8 encoded bytes.
         '''
         assert not os.path.exists(zipfilename)
         try:
@@ -234,6 +236,10 @@ class Workspace(Bead):
         return ws
 
 
+# archives are often written to network file systems: write them in big chunks
+_ZIP_WRITE_BUFFER_SIZE = 1024 * 1024
+
+
 class _ZipCreator:
     def __init__(self):
         self.hashes = {}
@@ -277,13 +283,16 @@ class _ZipCreator:
             'deflated': zipfile.ZIP_DEFLATED,
         }.get(user_compression_preference, zipfile.ZIP_DEFLATED)
         try:
-            with zipfile.ZipFile(
-                zip_file_name,
+            zip_file = open(zip_file_name, 'wb', buffering=_ZIP_WRITE_BUFFER_SIZE)
+            with zip_file, zipfile.ZipFile(
+                zip_file,
                 mode='w',
                 compression=compression,
                 allowZip64=True,
             ) as self.zipfile:
-                self.zipfile.comment = comment.encode('utf-8')
+                if isinstance(comment, str):
+                    comment = comment.encode('utf-8')
+                self.zipfile.comment = comment
                 self.add_data(workspace)
                 self.add_code(workspace)
                 self.add_meta(workspace, timestamp)
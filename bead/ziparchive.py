@@ -1,4 +1,5 @@
 from copy import deepcopy
+import functools
 import os
 import shutil
 
@@ -24,18 +25,31 @@ META_KEYS = (
 )
 
 
+# Searching boxes creates new ZipArchive instances for the same files again and again.
+# Archives are not expected to change, but the version of the file (its modification time
+# and size) is part of the key, so that a replaced file is read again.
+@functools.lru_cache(maxsize=4096)
+def _read_meta(archive_filename, version):
+    try:
+        return persistence.zip_load(
+            zipopener.open(archive_filename, version), layouts.Archive.BEAD_META)
+    except:
+        raise InvalidArchive(archive_filename)
+
+
 class ZipArchive(UnpackableBead):
 
     def __init__(self, filename, box_name=''):
         self.archive_filename = filename
         self.box_name = box_name
+        self._version = self._file_version()
         self._meta = self._load_meta()
         self._content_id = None
 
     @property
     def zipfile(self):
         try:
-            return zipopener.open(self.archive_filename)
+            return zipopener.open(self.archive_filename, self._version)
         except (zipopener.BadZipFile, OSError, IOError):
             raise InvalidArchive(self.archive_filename)
 
@@ -150,11 +164,15 @@ class ZipArchive(UnpackableBead):
         return tuple(meta.parse_inputs(self.meta))
 
     # -
-    def _load_meta(self):
+    def _file_version(self):
         try:
-            return self.zip_load(layouts.Archive.BEAD_META)
-        except:
+            stat = os.stat(self.archive_filename)
+        except OSError:
             raise InvalidArchive(self.archive_filename)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_meta(self):
+        return _read_meta(self.archive_filename, self._version)
 
     def extract_file(self, zip_path, fs_path):
         '''
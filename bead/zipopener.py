@@ -4,13 +4,17 @@ E.g. opening a zip file with >100000 files can easily take 15s in Python.
 This does not mean reading any file or even looping over the zip directory.
 
 For this reason this module provides a small LRU cache of open (for reading) zip files.
+The cache is per thread, so that threads do not close zip files in use by other threads.
+Files are opened with a version (e.g. modification time and size), a cached zip file
+of another version (a replaced file) is closed and the file is opened again.
 
 Actually having this module made the tests (which use only small files)
 run ~4% faster (5.14 -> 4.94 = 0.2s faster).
 """
 
 import atexit
-from typing import Dict, Tuple
+import threading
+from typing import Dict, Hashable, Tuple
 from zipfile import BadZipFile, ZipFile
 
 from tracelog import TRACELOG
@@ -19,20 +23,25 @@ __all__ = ('BadZipFile', 'open', 'close_all')
 
 FileName = str
 LogicalTime = int
+Version = Hashable
 
 
 class OpenZipLRUCache:
     def __init__(self, max_size: int = 10):
         self.max_size: int = max_size
         self.open_zip_files: Dict[FileName, ZipFile] = {}
+        self.versions: Dict[FileName, Version] = {}
         self.access_times: Dict[FileName, LogicalTime] = {}
         self.access_count: LogicalTime = 0
 
-    def open(self, filename):
+    def open(self, filename, version):
+        if filename in self.open_zip_files and self.versions[filename] != version:
+            self.close(filename)
         if filename not in self.open_zip_files:
             if len(self.open_zip_files) == self.max_size:
                 self.close(self.least_recently_used_filename)
             self.open_zip_files[filename] = ZipFile(filename)
+            self.versions[filename] = version
 
         self.access(filename)
         return self.open_zip_files[filename]
@@ -42,7 +51,7 @@ class OpenZipLRUCache:
         def access_time(filename_access_time: Tuple[FileName, LogicalTime]):
             _, access_time = filename_access_time
             return access_time
-        least_recently_used_filename, _ = sorted(self.access_times.items(), key=access_time)[0]
+        least_recently_used_filename, _ = min(self.access_times.items(), key=access_time)
         TRACELOG(
             f'{least_recently_used_filename}: {self.access_times[least_recently_used_filename]}')
         return least_recently_used_filename
@@ -56,6 +65,7 @@ class OpenZipLRUCache:
         TRACELOG(f'{filename}')
         self.open_zip_files[filename].close()
         del self.open_zip_files[filename]
+        del self.versions[filename]
         del self.access_times[filename]
 
     def close_all(self):
@@ -63,14 +73,24 @@ class OpenZipLRUCache:
             self.close(filename)
 
 
-_cache = OpenZipLRUCache()
+class _ThreadLocalCache(threading.local):
+    def __init__(self):
+        self.cache = OpenZipLRUCache()
+
+
+_thread_local = _ThreadLocalCache()
+
+
+def open(filename, version):
+    return _thread_local.cache.open(filename, version)
+
 
-open = _cache.open
-close_all = _cache.close_all
+def close_all():
+    _thread_local.cache.close_all()
 
 
 def _cleanup():
-    TRACELOG(vars(_cache))
+    TRACELOG(vars(_thread_local.cache))
     close_all()
 
 
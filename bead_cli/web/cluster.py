@@ -49,13 +49,17 @@ class Cluster:
                 reverse=True))
 
     def reset_freshness(self):
-        beads = self.beads()
+        beads = self.beads_by_content_id.values()
+        if not beads:
+            return
+        newest = max(beads, key=(lambda bead: bead.freeze_time))
 
-        if beads and beads[0].is_not_phantom:
-            beads[0].set_freshness(Freshness.UP_TO_DATE)
+        for bead in beads:
+            if bead is not newest:
+                bead.set_freshness(Freshness.SUPERSEDED)
 
-        for bead in beads[1:]:
-            bead.set_freshness(Freshness.SUPERSEDED)
+        if newest.is_not_phantom:
+            newest.set_freshness(Freshness.UP_TO_DATE)
 
     @property
     def as_dot(self):